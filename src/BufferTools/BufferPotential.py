@@ -5,6 +5,7 @@
 # License:     Contextual Copyleft AI (CCAI) License v1.0.
 #              Full license in LICENSE file.
 # --------------------------------------------------------------------------------
+import os
 import arcpy
 
 from ..helpers import license, empty_workspace, reload_module, log, raster_and_layer
@@ -132,10 +133,8 @@ class BufferPotential:
         if not parameters[6].hasBeenValidated:
             if parameters[6].value:
                 parameters[7].enabled = True
-                values2 = []
-                with arcpy.da.SearchCursor(parameters[5].value, parameters[6].value) as cursor2:
-                        values2 = sorted({row2[0] for row2 in cursor2})
-                parameters[7].filter.list = values2
+                with arcpy.da.SearchCursor(parameters[5].value, parameters[6].value) as cursor:
+                    parameters[7].filter.list = sorted({row[0] for row in cursor})
             else:
                 parameters[7].enabled = False
 
@@ -160,6 +159,9 @@ class BufferPotential:
         log("setting up project")
         project, active_map = setup()
 
+        # let the Pairwise* geoprocessing tools used below run on every core
+        arcpy.env.parallelProcessingFactor = "100%"
+
         log("reading in parameters")
         stream = parameters[0].value
         min_width = parameters[1].valueAsText
@@ -179,12 +181,13 @@ class BufferPotential:
 
         # create scratch layers
         log("creating scratch layers")
-        scratch_stream_buffer = arcpy.CreateScratchName("stream_buffer", data_type="FeatureClass", workspace=arcpy.env.scratchGDB)
-        scratch_land_use_polygon = arcpy.CreateScratchName("land_use", data_type="FeatureClass", workspace=arcpy.env.scratchGDB)
-        scratch_union = arcpy.CreateScratchName("union", data_type="FeatureClass", workspace=arcpy.env.scratchGDB)
-        scratch_erase = arcpy.CreateScratchName("erase", data_type="FeatureClass", workspace=arcpy.env.scratchGDB)
-        scratch_dissolve = arcpy.CreateScratchName("dissolve", data_type="FeatureClass", workspace=arcpy.env.scratchGDB)
-        land_use_raster_clip = arcpy.CreateScratchName("lu_clip", data_type="RasterDataset", workspace=arcpy.env.scratchGDB)
+        ws = arcpy.env.scratchGDB
+        scratch_stream_buffer = arcpy.CreateScratchName("stream_buffer", data_type="FeatureClass", workspace=ws)
+        scratch_land_use_polygon = arcpy.CreateScratchName("land_use", data_type="FeatureClass", workspace=ws)
+        scratch_union = arcpy.CreateScratchName("union", data_type="FeatureClass", workspace=ws)
+        scratch_erase = arcpy.CreateScratchName("erase", data_type="FeatureClass", workspace=ws)
+        scratch_dissolve = arcpy.CreateScratchName("dissolve", data_type="FeatureClass", workspace=ws)
+        land_use_raster_clip = arcpy.CreateScratchName("lu_clip", data_type="RasterDataset", workspace=ws)
 
         # pairwise buffer stream
         log("creating buffer polygon around stream")
@@ -199,7 +202,6 @@ class BufferPotential:
         log("extracting desired land uses")
         scratch_land_use = None
         land_use_sql_query = ""
-        existing_values = []
         with arcpy.da.SearchCursor(land_use_raster_clip, land_use_field) as cursor:
             existing_values = sorted({row[0] for row in cursor})
         land_use_values = [ i for i in land_use_values if i in existing_values ]
@@ -216,7 +218,7 @@ class BufferPotential:
 
         # convert land usage output to polygon
         log("converting land use areas to polygon")
-        arcpy.conversion.RasterToPolygon(scratch_land_use, scratch_land_use_polygon, "NO_SIMPLIFY", "VALUE")
+        arcpy.conversion.RasterToPolygon(scratch_land_use, scratch_land_use_polygon, "SIMPLIFY", "VALUE")
 
         # iterate through exclusion layers and remove
         if calculate_wetlands:
@@ -239,14 +241,21 @@ class BufferPotential:
             multi_part="SINGLE_PART",
         )
 
-        # calculate acreage
-        log("calculating acreage of planting areas")
-        arcpy.management.AddField(scratch_dissolve, "Acres", "FLOAT", 2, 2)
-        arcpy.management.CalculateGeometryAttributes(scratch_dissolve, geometry_property=[["Acres", "AREA_GEODESIC"]], area_unit="ACRES_US")
+        # create output feature class
+        log("creating output feature class")
+        spatial_reference = arcpy.Describe(scratch_dissolve).spatialReference
+        arcpy.management.CreateFeatureclass(os.path.dirname(output_file), os.path.basename(output_file), "POLYGON", spatial_reference=spatial_reference)
+        arcpy.management.AddField(output_file, "Acres", "FLOAT", 2, 2)
 
-        # drop acreage < threshold
-        sql_query = "Acres >= {}".format(min_acres)
-        arcpy.analysis.Select(scratch_dissolve, output_file, sql_query)
+        # calculate acreage and drop acreage < threshold in a single pass
+        log("calculating acreage of planting areas")
+        acres_factor = arcpy.ArealUnitConversionFactor("SquareMeters", "AcresUS")
+        with arcpy.da.SearchCursor(scratch_dissolve, ["SHAPE@"]) as search_cursor:
+            with arcpy.da.InsertCursor(output_file, ["SHAPE@", "Acres"]) as insert_cursor:
+                for shape, in search_cursor:
+                    acres = shape.getArea("GEODESIC", "SQUAREMETERS") * acres_factor
+                    if acres >= min_acres:
+                        insert_cursor.insertRow([shape, acres])
 
         # add output to map
         log("adding output to map")
@@ -254,7 +263,7 @@ class BufferPotential:
 
         # cleanup
         log("deleting unneeded data")
-        empty_workspace(arcpy.env.scratchGDB, keep=[])
+        empty_workspace(ws, keep=[])
 
         # save
         log("saving project")
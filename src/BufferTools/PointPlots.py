@@ -14,11 +14,12 @@
 # --------------------------------------------------------------------------------
 
 import os
+import csv
 import math
 import arcpy
 import platform
 
-from ..helpers import license, empty_workspace, set_required_parameter, reload_module, log
+from ..helpers import license, empty_workspace, scratch_workspace, set_required_parameter, reload_module, log
 from ..helpers import setup_environment as setup
 from ..helpers import validate_spatial_reference as validate
 
@@ -62,7 +63,14 @@ class PointPlots:
             datatype="DEType",
             direction="Input")
 
-        params = [param0, param1, param2, param3]
+        param4 = arcpy.Parameter(
+            displayName="Save project when finished?",
+            name="save_project",
+            datatype="GPBoolean",
+            parameterType="Optional",
+            direction="Input")
+
+        params = [param0, param1, param2, param3, param4]
         return params
 
     def isLicensed(self):
@@ -93,100 +101,119 @@ class PointPlots:
         log("setting up project")
         project, active_map = setup()
 
+        # let the Pairwise* geoprocessing tools used below run on every core
+        arcpy.env.parallelProcessingFactor = "100%"
+
         log("reading in parameters")
         planting_area = parameters[0].value
         output_points = parameters[1].valueAsText
         coords = parameters[2].value
         output_coords = parameters[3].valueAsText
 
-        # create scratch layers
+        # create scratch layers, in memory unless the input is very large
         log("creating scratch layers")
-        scratch_buffer = arcpy.CreateScratchName("scratch_buffer", data_type="DEFeatureClass", workspace=arcpy.env.scratchGDB)
-        scratch_dissolve = arcpy.CreateScratchName("scratch_dissolve", data_type="DEFeatureClass", workspace=arcpy.env.scratchGDB)
-
-        # dissolve
-        log("dissolve polygons")
-        arcpy.management.Dissolve(planting_area, scratch_dissolve, multi_part="MULTI_PART")
+        ws = scratch_workspace(planting_area)
+        scratch_buffer = arcpy.CreateScratchName("scratch_buffer", data_type="DEFeatureClass", workspace=ws)
+        scratch_dissolve = arcpy.CreateScratchName("scratch_dissolve", data_type="DEFeatureClass", workspace=ws)
 
-        # calculate total area of planting
+        # calculate total area of the input polygons, overlapping polygons are
+        # counted twice so this is an upper bound on the planting acreage
         log("calculate acreage")
-        field_name = "Acres"
-        arcpy.management.AddField(scratch_dissolve, field_name, "FLOAT")
-        arcpy.management.CalculateGeometryAttributes(in_features=scratch_dissolve, geometry_property=[[field_name, "AREA_GEODESIC"]], area_unit="ACRES_US")
+        acres_factor = arcpy.ArealUnitConversionFactor("SquareMeters", "AcresUS")
+        with arcpy.da.SearchCursor(planting_area, ["SHAPE@"]) as cursor:
+            areas = [row[0].getArea("GEODESIC", "SQUAREMETERS") for row in cursor]
+        acreage = sum(areas) * acres_factor
+
+        # only dissolve when the planting area can hold point plots, the inner
+        # buffer below needs shared boundaries removed and the dissolved area
+        # corrects any double counted overlaps
+        if acreage >= 0.5:
+            if len(areas) == 1:
+                # a single polygon has nothing to dissolve and its area is exact
+                log("copy polygon")
+                arcpy.management.CopyFeatures(planting_area, scratch_dissolve)
+            else:
+                log("dissolve polygons")
+                arcpy.management.Dissolve(planting_area, scratch_dissolve, multi_part="MULTI_PART")
+                with arcpy.da.SearchCursor(scratch_dissolve, ["SHAPE@"]) as cursor:
+                    acreage = max((row[0].getArea("GEODESIC", "SQUAREMETERS") * acres_factor for row in cursor), default=0.0)
 
         # determine number of sampling plots
         #   < 1/2 acres - monitor 100%
         #   < 3 acres - plot radius 26.3ft; 2 / acre
         #   > 3 acres - plot radius 26.3ft; 1 / acre
-        values = [row[0] for row in arcpy.da.SearchCursor(scratch_dissolve, field_name)]
-        acreage = max(set(values))
-
         radius = 26.3
-        num = 1
 
         if acreage < 0.5:
             log("Buffer less than 0.5 acres, please assess 100% of the buffer without point plots")
         else:
-            if acreage >= 0.5 and acreage < 3:
-                num = int(math.ceil(acreage * 2))
-            elif acreage >= 3:
-                num = int(math.ceil(acreage * 1))
+            plots_per_acre = 2 if acreage < 3 else 1
+            num = math.ceil(acreage * plots_per_acre)
 
+            # create buffer inside the planting area and check it has room for every
+            # plot before sampling, otherwise use smaller and more numerous plots. the
+            # area is geodesic square feet, the same unit as the radius in feet
+            log("buffer output area")
             try:
-                # create buffer inside the planting area
-                log("buffer output area")
                 arcpy.analysis.PairwiseBuffer(scratch_dissolve, scratch_buffer, "{} Feet".format(-radius))
+                with arcpy.da.SearchCursor(scratch_buffer, ["SHAPE@"]) as cursor:
+                    buffer_area = sum(row[0].getArea("GEODESIC", "SQUAREFEET") for row in cursor)
+            except arcpy.ExecuteError:
+                # the planting area is too narrow to buffer inward by the radius
+                buffer_area = 0
 
-                # create random plot centers
-                log("create sampling locations")
-                arcpy.management.CreateSpatialSamplingLocations(scratch_buffer, output_points, sampling_method="STRAT_POLY", strata_id_field=None, strata_count_method="PROP_AREA", num_samples=num, geometry_type="POINT", min_distance="{} Feet".format(radius*2))
-
-            except:
-                log("Failed to create {} point plots with a radius of {} feet. It is likely because the buffer is too narrow to fit all of the point plots.".format(num, radius))
+            if buffer_area < num * (radius * 2) ** 2:
+                log("The buffer is too narrow to fit {} point plots with a radius of {} feet.".format(num, radius))
 
                 radius = 11.8
-                num = int(math.ceil(acreage * 10))
+                num = math.ceil(acreage * 10)
 
-                log("Trying again to make {} point plots with a radius of {} feet.".format(num, radius))
+                log("Making {} point plots with a radius of {} feet instead.".format(num, radius))
 
                 # create buffer inside the planting area
                 log("buffer output area")
                 arcpy.analysis.PairwiseBuffer(scratch_dissolve, scratch_buffer, "{} Feet".format(-radius))
 
-                # create random plot centers
-                log("create sampling locations")
-                arcpy.management.CreateSpatialSamplingLocations(scratch_buffer, output_points, sampling_method="STRAT_POLY", strata_id_field=None, strata_count_method="PROP_AREA", num_samples=num, geometry_type="POINT", min_distance="{} Feet".format(radius*2))
+            # create random plot centers
+            log("create sampling locations")
+            arcpy.management.CreateSpatialSamplingLocations(scratch_buffer, output_points, sampling_method="STRAT_POLY", strata_id_field=None, strata_count_method="PROP_AREA", num_samples=num, geometry_type="POINT", min_distance="{} Feet".format(radius*2))
 
             # add data to map
             log("add data to map")
-            points_lyr = active_map.addDataFromPath(output_points)
+            active_map.addDataFromPath(output_points)
 
             if coords:
                 log("calculating point x y coordinates")
                 # add coordinate fields
-                arcpy.management.AddField(points_lyr, "x_coord", "FLOAT", 6, 6, field_alias="X Coordinate")
-                arcpy.management.AddField(points_lyr, "y_coord", "FLOAT", 6, 6, field_alias="X Coordinate")
-
-                # calculate geometry - coordinates
-                arcpy.management.CalculateGeometryAttributes(in_features=points_lyr.name, geometry_property=[["x_coord", "POINT_X"]],coordinate_format="DD")
-                arcpy.management.CalculateGeometryAttributes(in_features=points_lyr.name, geometry_property=[["y_coord", "POINT_Y"]],coordinate_format="DD")
+                arcpy.management.AddFields(output_points, [["x_coord", "FLOAT", "X Coordinate"], ["y_coord", "FLOAT", "Y Coordinate"]])
 
-                # export attribute table to csv at path
+                # calculate geometry - coordinates in decimal degrees of the
+                # output's geographic coordinate system in a single cursor pass
+                # and write them straight to csv at path
                 log("exporting point plot coordinates")
-                arcpy.conversion.ExportTable(output_points, r"{}/point_plots.csv".format(output_coords))
-
-
-                if platform.system() == "Windows":
-                    # open coordinates folder
-                    log("opening folder with coordinates")
-                    os.startfile(output_coords)
+                desc = arcpy.da.Describe(output_points)
+                gcs = desc["spatialReference"].GCS
+                with open(r"{}/point_plots.csv".format(output_coords), "w", newline="") as csv_file:
+                    writer = csv.writer(csv_file)
+                    writer.writerow([desc["OIDFieldName"], "x_coord", "y_coord"])
+                    with arcpy.da.UpdateCursor(output_points, ["OID@", "SHAPE@", "x_coord", "y_coord"]) as cursor:
+                        for oid, shape, _, _ in cursor:
+                            point = shape.projectAs(gcs).firstPoint
+                            cursor.updateRow([oid, shape, point.X, point.Y])
+                            writer.writerow([oid, point.X, point.Y])
 
         # cleanup
         log("deleting unneeded data")
-        empty_workspace(arcpy.env.scratchGDB, keep=[])
+        empty_workspace(ws, keep=[])
+
+        # save, opt-in since serializing the project can dominate short or batched runs
+        if parameters[4].value and active_map is not None:
+            log("saving project")
+            project.save()
 
-        # save
-        log("saving project")
-        project.save()
+        if coords and acreage >= 0.5 and platform.system() == "Windows":
+            # open coordinates folder
+            log("opening folder with coordinates")
+            os.startfile(output_coords)
 
         return
@@ -7,10 +7,11 @@
 #              Full license in LICENSE file.
 # --------------------------------------------------------------------------------
 
+import os
 import math
 import arcpy
 
-from ..helpers import license, empty_workspace, reload_module, log
+from ..helpers import license, empty_workspace, scratch_workspace, reload_module, log
 from ..helpers import setup_environment as setup
 from ..helpers import validate_spatial_reference as validate
 
@@ -63,7 +64,14 @@ class ShrubClusters:
         param4.filter.type = "ValueList"
         param4.filter.list = ["Square", "Circle"]
 
-        params = [param0, param1, param2, param3, param4]
+        param5 = arcpy.Parameter(
+            displayName="Save project when finished?",
+            name="save_project",
+            datatype="GPBoolean",
+            parameterType="Optional",
+            direction="Input")
+
+        params = [param0, param1, param2, param3, param4, param5]
         return params
 
     def isLicensed(self):
@@ -98,11 +106,11 @@ class ShrubClusters:
         number = parameters[3].value
         geom_type = "CIRCLE" if parameters[4].valueAsText == "Circle" else "ENVELOPE"
 
-        # create scratch layers
+        # create scratch layers, in memory unless the input is very large
         log("creating scratch layers")
-        scratch_area = arcpy.CreateScratchName("scratch_area", data_type="DEFeatureClass", workspace=arcpy.env.scratchGDB)
-        scratch_points = arcpy.CreateScratchName("scratch_points", data_type="DEFeatureClass", workspace=arcpy.env.scratchGDB)
-        scratch_buffer = arcpy.CreateScratchName("scratch_buffer", data_type="DEFeatureClass", workspace=arcpy.env.scratchGDB)
+        ws = scratch_workspace(area)
+        scratch_area = arcpy.CreateScratchName("scratch_area", data_type="DEFeatureClass", workspace=ws)
+        scratch_points = arcpy.CreateScratchName("scratch_points", data_type="DEFeatureClass", workspace=ws)
 
         # create buffer inside the planting area
         log("buffer output area")
@@ -123,31 +131,56 @@ class ShrubClusters:
             spatial_relationship="HAVE_THEIR_CENTER_IN"
         )
 
-        # buffer points by width
-        log("creating buffer around shrub cluster points")
-        arcpy.analysis.Buffer(
-            in_features=scratch_points,
-            out_feature_class=scratch_buffer,
-            buffer_distance_or_field="{} {}".format(width, width_unit),
-        )
-
-        # make square around buffer
         log("creating {} {} shrub clusters".format(int(number), parameters[4].valueAsText.lower()))
-        arcpy.management.MinimumBoundingGeometry(
-            in_features=scratch_buffer,
-            out_feature_class=output_file,
-            geometry_type=geom_type,
-            group_option="NONE",
-            group_field=None,
-            mbg_fields_option="NO_MBG_FIELDS"
-        )
+        spatial_reference = arcpy.Describe(scratch_points).spatialReference
+        if spatial_reference.type == "Geographic":
+            # widths in degrees vary with latitude, let pairwise buffer and minimum
+            # bounding geometry handle the geodesic distances
+            scratch_buffer = arcpy.CreateScratchName("scratch_buffer", data_type="DEFeatureClass", workspace=ws)
+            arcpy.analysis.PairwiseBuffer(
+                in_features=scratch_points,
+                out_feature_class=scratch_buffer,
+                buffer_distance_or_field="{} {}".format(width, width_unit),
+            )
+            arcpy.management.MinimumBoundingGeometry(
+                in_features=scratch_buffer,
+                out_feature_class=output_file,
+                geometry_type=geom_type,
+                group_option="NONE",
+                group_field=None,
+                mbg_fields_option="NO_MBG_FIELDS"
+            )
+        else:
+            # make clusters around the point locations, the minimum bounding circle or
+            # envelope of a buffered point is a closed form of the point and the width
+            # so the cluster geometry is built directly instead of buffering
+            # distance is the baseline buffer distance, half of the cluster width
+            distance = width * arcpy.LinearUnitConversionFactor(width_unit, "Meters") / spatial_reference.metersPerUnit
+            # the clusters keep the attributes of their points as the buffer did
+            arcpy.management.CreateFeatureclass(os.path.dirname(output_file), os.path.basename(output_file), "POLYGON", template=scratch_points, spatial_reference=spatial_reference)
+            point_fields = [f.name for f in arcpy.ListFields(scratch_points) if f.editable and f.type not in ("OID", "Geometry")]
+            with arcpy.da.SearchCursor(scratch_points, ["SHAPE@XY"] + point_fields) as point_cursor:
+                with arcpy.da.InsertCursor(output_file, ["SHAPE@"] + point_fields) as cluster_cursor:
+                    for (x, y), *attributes in point_cursor:
+                        if geom_type == "ENVELOPE":
+                            corners = arcpy.Array([
+                                arcpy.Point(x - distance, y - distance),
+                                arcpy.Point(x + distance, y - distance),
+                                arcpy.Point(x + distance, y + distance),
+                                arcpy.Point(x - distance, y + distance),
+                            ])
+                            cluster = arcpy.Polygon(corners, spatial_reference)
+                        else:
+                            cluster = arcpy.PointGeometry(arcpy.Point(x, y), spatial_reference).buffer(distance)
+                        cluster_cursor.insertRow([cluster] + attributes)
 
         # cleanup
         log("deleting unneeded data")
-        empty_workspace(arcpy.env.scratchGDB, keep=[])
+        empty_workspace(ws, keep=[])
 
-        # save
-        log("saving project")
-        project.save()
+        # save, opt-in since serializing the project can dominate short or batched runs
+        if parameters[5].value and active_map is not None:
+            log("saving project")
+            project.save()
 
         return
@@ -7,41 +7,95 @@
 # --------------------------------------------------------------------------------
 
 import os
+import json
 import math
 import arcpy
+import numpy as np
 
-from ..helpers import license, reload_module, log, empty_workspace
+from ..helpers import license, reload_module, log, empty_workspace, scratch_workspace, convert_length
 from ..helpers import setup_environment as setup
 from ..helpers import validate_spatial_reference as validate
 
-def generate_transects(line, interval, width):
-    """ Generate transects of length WIDTH along a LINE at a given INTERVAL.
-    line - arcpy.PolyLine() object
-    interval - <GPLinearUnit>
-    width - <GPLinearUnit>
+# orjson parses long SHAPE@JSON strings several times faster when it is installed
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
+def transect_endpoints(paths, interval, width):
+    """ Returns an (n, 4) array of x0, y0, x1, y1 transect endpoints of length
+    WIDTH along the line PATHS at a given INTERVAL.
+    paths - list of [x, y] vertex lists, one per line part
+    interval - <float> interval in the line's linear unit
+    width - <float> transect width in the line's linear unit
+    """
+    # walk the line's segments in numpy instead of probing the geometry with
+    # positionAlongLine for every transect
+    segments = []
+    for path in paths:
+        vertices = np.asarray(path, dtype=np.float64)[:, :2]
+        if len(vertices) > 1:
+            segments.append(np.hstack((vertices[:-1], vertices[1:])))
+    if not segments:
+        return np.empty((0, 4))
+    segments = np.vstack(segments)
+    dx = segments[:, 2] - segments[:, 0]
+    dy = segments[:, 3] - segments[:, 1]
+    segment_length = np.hypot(dx, dy)
+
+    # drop duplicate vertices, they have no direction
+    keep = segment_length > 0
+    segments, dx, dy, segment_length = segments[keep], dx[keep], dy[keep], segment_length[keep]
+    if len(segments) == 0:
+        return np.empty((0, 4))
+    segment_end = np.cumsum(segment_length)
+
+    # distances along the line, the last transect is clamped to the line's end
+    length = segment_end[-1]
+    distance = np.minimum(np.arange(0, length + interval, interval), length)
+
+    # interpolate transect midpoints on the segment each distance falls on
+    index = np.minimum(np.searchsorted(segment_end, distance), len(segments) - 1)
+    t = (distance - (segment_end[index] - segment_length[index])) / segment_length[index]
+    x = segments[index, 0] + t * dx[index]
+    y = segments[index, 1] + t * dy[index]
+
+    # offset perpendicular to the segment direction half the width each way
+    half_width = width / 2
+    offset_x = half_width * dy[index] / segment_length[index]
+    offset_y = half_width * dx[index] / segment_length[index]
+
+    return np.column_stack((x - offset_x, y + offset_y, x + offset_x, y - offset_y))
+
+def vertex_transect_endpoints(vertices, width):
+    """ Returns an (n, 4) array of x0, y0, x1, y1 endpoints of transects of length
+    WIDTH at each of a line's VERTICES, matching transect_line at a vertex.
+    vertices - (n, 2) array of a line part's x, y vertices
+    width - <float> transect width in the line's linear unit
     """
-    interval, interval_unit = interval.split(" ")
-    transects = []
+    vertices = np.asarray(vertices, dtype=np.float64)[:, :2]
 
-    # positionAlongLine fails to get start point dist=0 if using geodesic=True
-    # so we use geodesic=False which uses Meters as linear unit instead of line unit
-    interval = int(float(interval) * arcpy.LinearUnitConversionFactor(interval_unit, "Meters"))
-    length = line.getLength("GEODESIC", units="Meters")
-    for dist in range(0, int(length)+interval, interval):
-        # get point at distance
-        point = line.positionAlongLine(dist, geodesic=False)[0]
+    # unit direction of each segment, duplicate vertices have no direction
+    segments = np.diff(vertices, axis=0)
+    segment_length = np.hypot(segments[:, 0], segments[:, 1])[:, None]
+    unit = np.divide(segments, segment_length, out=np.zeros_like(segments), where=segment_length > 0)
 
-        #create transect at point
-        transect = transect_line(line, point, width)
-        transects.append(transect)
+    # the line's direction through a vertex bisects its incoming and outgoing
+    # segments, end vertices only have one, a hairpin falls back to north
+    zero = np.zeros((1, 2))
+    direction = np.vstack((zero, unit)) + np.vstack((unit, zero))
+    direction_length = np.hypot(direction[:, 0], direction[:, 1])[:, None]
+    direction = np.divide(direction, direction_length, out=np.tile([0.0, 1.0], (len(direction), 1)), where=direction_length > 0)
 
-    return transects
+    # offset perpendicular to the direction half the width each way
+    offset = (width / 2) * np.column_stack((direction[:, 1], -direction[:, 0]))
+    return np.hstack((vertices - offset, vertices + offset))
 
 def transect_line(line, point, transect_width):
     """Returns a transect to LINE at POINT of length TRANSECT_WIDTH.
     line - arcpy.PolyLine() object
     point - arcpy.Point() object
-    transect_width - <GPLinearUnit>
+    transect_width - <float> transect width in the line's linear unit
     """
 
     # epsilon
@@ -52,9 +106,7 @@ def transect_line(line, point, transect_width):
     geom = point[0]
     distance = point[1]
     spatial_reference = line.spatialReference
-    line_unit = spatial_reference.linearUnitName
-    transect_length, transect_length_unit = transect_width.split(" ")
-    transect_length = float(transect_length) * arcpy.LinearUnitConversionFactor(transect_length_unit, line_unit)
+    transect_length = transect_width
 
     # get points immediately before and after midpoint
     before = line.positionAlongLine(distance-e, False)
@@ -168,11 +220,12 @@ class GenerateCrossSections(object):
         interval = parameters[4].valueAsText
         remove = parameters[5].value
 
-        # create scratch layers
+        # create scratch layers, in memory unless the input is very large
         log("creating scratch layers")
-        scratch_streams = arcpy.CreateScratchName("streams", data_type="FeatureClass", workspace=arcpy.env.scratchGDB)
-        scratch_intersection = arcpy.CreateScratchName("intersect", data_type="FeatureClass", workspace=arcpy.env.scratchGDB)
-        scratch_transects = arcpy.CreateScratchName("transects", data_type="FeatureClass", workspace=arcpy.env.scratchGDB)
+        ws = scratch_workspace(streams)
+        scratch_streams = arcpy.CreateScratchName("streams", data_type="FeatureClass", workspace=ws)
+        scratch_intersection = arcpy.CreateScratchName("intersect", data_type="FeatureClass", workspace=ws)
+        scratch_transects = arcpy.CreateScratchName("transects", data_type="FeatureClass", workspace=ws)
 
         # set analysis extent
         if extent:
@@ -184,8 +237,13 @@ class GenerateCrossSections(object):
 
         # output spatial reference
         log("finding output spatial reference")
-        stream_desc = arcpy.Describe(scratch_streams)
-        spatial_reference = stream_desc.spatialReference.name
+        stream_spatial_reference = arcpy.da.Describe(scratch_streams)["spatialReference"]
+        spatial_reference = stream_spatial_reference.name
+
+        # convert the interval and width once for every stream line
+        line_unit = stream_spatial_reference.linearUnitName
+        interval = float(convert_length(interval, line_unit).split(" ")[0])
+        width = float(convert_length(width, line_unit).split(" ")[0])
 
         # create output feature class
         log("creating output feature class")
@@ -193,14 +251,16 @@ class GenerateCrossSections(object):
 
         # generating transects
         log("generating transects")
-        n = len([row[0] for row in arcpy.da.SearchCursor(scratch_streams, ["SHAPE@"])])
+        n = int(arcpy.management.GetCount(scratch_streams)[0])
         log("iterating through {} stream lines".format(n))
-        with arcpy.da.SearchCursor(scratch_streams, ["SHAPE@"]) as stream_cursor:
-            with arcpy.da.InsertCursor(transects_fc, ["SHAPE@"]) as transect_cursor:
+        with arcpy.da.SearchCursor(scratch_streams, ["SHAPE@JSON"]) as stream_cursor:
+            with arcpy.da.InsertCursor(transects_fc, ["SHAPE@JSON"]) as transect_cursor:
                 for stream_line in stream_cursor:
-                    transects = generate_transects(stream_line[0], interval, width)
-                    for transect in transects:
-                        transect_cursor.insertRow([transect])
+                    # read vertices and write endpoints as json, skipping geometry
+                    # objects for both the stream lines and the transects
+                    paths = json_loads(stream_line[0]).get("paths", [])
+                    for x0, y0, x1, y1 in transect_endpoints(paths, interval, width).tolist():
+                        transect_cursor.insertRow([json.dumps({"paths": [[[x0, y0], [x1, y1]]]})])
 
 
         # optionally remove intersections
@@ -261,7 +321,7 @@ class GenerateCrossSections(object):
 
         # cleanup
         log("deleting unneeded data")
-        empty_workspace(arcpy.env.scratchGDB)
+        empty_workspace(ws, keep=[])
 
         # save project
         log("saving project")
@@ -6,14 +6,25 @@
 #              Full license in LICENSE file.
 # --------------------------------------------------------------------------------
 
-import math
+import json
 import arcpy
+import numpy as np
 
-from .GenerateCrossSections import transect_line
-from ..helpers import license, reload_module, log, raster_and_layer
+from .GenerateCrossSections import vertex_transect_endpoints
+from ..helpers import license, reload_module, log, raster_and_layer, raster_window, sample_window, extract_values
 from ..helpers import setup_environment as setup
 from ..helpers import validate_spatial_reference as validate
 
+# orjson parses long SHAPE@JSON strings several times faster when it is installed
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
+# largest dem window read into memory for a reach, about 400 MB as float64, larger
+# reaches are sampled with ExtractValuesToPoints when spatial analyst is available
+MAX_WINDOW_CELLS = 50000000
+
 class LeastAction(object):
     def __init__(self):
         """Define the tool (tool name is the name of the class)."""
@@ -65,51 +76,46 @@ class LeastAction(object):
         params = [param0, param1, param2, param3, param4]
         return params
 
-    def lowestTransectPoint(self, transect, dem_raster):
-        '''return lowest point along transect
-        transect - arcpy.PolyLine() object
-        dem_raster - elevation raster
-        existing_elev - existing elevation of stream line at point
+    def lowestTransectPoints(self, endpoints, sample_elevations):
+        '''return the lowest (x, y) point along each transect
+        endpoints - (n, 4) array of x0, y0, x1, y1 of transects of equal length
+        sample_elevations - function returning the elevations at arrays of x and y coordinates
         '''
-        # get points via densify
-        vertex_spacing = 1
-        densified_transect = transect.densify("DISTANCE", vertex_spacing)
+        # get points every vertex_spacing or less along every transect at once,
+        # one row per transect
+        x0, y0, x1, y1 = (endpoints[:, [i]] for i in range(4))
+        transect_length = np.hypot(x1[0, 0] - x0[0, 0], y1[0, 0] - y0[0, 0])
+        num_vertices = int(np.ceil(transect_length)) + 1
+        t = np.linspace(0, 1, num_vertices)
+        xs = x0 + t * (x1 - x0)
+        ys = y0 + t * (y1 - y0)
+        vertex_spacing = transect_length / (num_vertices - 1)
+
+        # sample the elevation of every vertex at once
+        elevs = sample_elevations(xs, ys)
 
         # get existing stream elevation
-        num_vertices = len(densified_transect[0])
         mid_index = int((num_vertices - 1)/2) # always round number because user supplies search distance: transect width = 2x search distance
-        mid_vertex = densified_transect[0][mid_index]
-        stream_coord = "{} {}".format(mid_vertex.X, mid_vertex.Y)
-        stream_elev_result = arcpy.management.GetCellValue(dem_raster, stream_coord)
-        stream_elev = float(stream_elev_result.getOutput(0))
+        stream_elev = elevs[:, [mid_index]]
 
         # average max distance of adjustment = transect_width / 2
         transect_width = vertex_spacing * (num_vertices - 1)
         ave_dist = transect_width / 2
 
-        # set up helpers
-        current_adjustment_weight = 0
-        vertex_distance = 0
-        point_tmp = ""
-
-        for vertex in densified_transect[0]:
-            coord = "{} {}".format(vertex.X, vertex.Y)
-            elev_result = arcpy.management.GetCellValue(dem_raster, coord)
-            elev = float(elev_result.getOutput(0))
-            delta_elev = stream_elev - elev # positive number is a good adjustment
-            distance = abs(vertex_distance - ave_dist)
-            # weighted adjustment weights the reduction in elevation with a weight from 0 - 1
-            # based off of a normal distribution for the supplied serach distance
-            weighted_adjustment = delta_elev * math.exp(-math.pow(distance,2)/(math.pow(ave_dist,2)))
-            if weighted_adjustment >= current_adjustment_weight and delta_elev > 0.2:
-                point_tmp = arcpy.Point(vertex.X, vertex.Y)
-                current_adjustment_weight = weighted_adjustment
-            vertex_distance += vertex_spacing
-
-        if point_tmp == "":
-            point_tmp = arcpy.Point(mid_vertex.X, mid_vertex.Y)
-
-        return point_tmp
+        # weighted adjustment weights the reduction in elevation with a weight from 0 - 1
+        # based off of a normal distribution for the supplied serach distance, the
+        # weights are the same for every transect
+        delta_elev = stream_elev - elevs # positive number is a good adjustment
+        distance = np.arange(num_vertices) * vertex_spacing - ave_dist
+        weight = np.exp(-(distance * distance) * (1.0 / (ave_dist * ave_dist)))
+        weighted_adjustment = np.where(delta_elev > 0.2, delta_elev * weight, -np.inf)
+
+        # fall back to the existing stream vertex if no vertex is low enough
+        lowest_index = weighted_adjustment.argmax(axis=1)
+        rows = np.arange(len(endpoints))
+        lowest_index[weighted_adjustment[rows, lowest_index] == -np.inf] = mid_index
+
+        return np.column_stack((xs[rows, lowest_index], ys[rows, lowest_index]))
 
     def updateParameters(self, parameters):
         return
@@ -137,15 +143,13 @@ class LeastAction(object):
         output_file = parameters[3].valueAsText
         distance = parameters[4].valueAsText
         distance, distance_unit = distance.split(" ")
-        transect_length = "{} {}".format(float(distance) * 2, distance_unit)
 
         # set analysis extent
         if extent:
             arcpy.env.extent = extent
 
         # output spatial reference
-        stream_desc = arcpy.Describe(streams)
-        spatial_reference = stream_desc.spatialReference.name
+        spatial_reference = arcpy.da.Describe(streams)["spatialReference"]
 
         # clip streams to analysis area
         log("creating output stream feature class")
@@ -158,6 +162,11 @@ class LeastAction(object):
         else:
             arcpy.management.CopyFeatures(streams, new_stream_line)
 
+        # the copied streams are written in the output coordinate system, so the walked
+        # vertices and the transect length are in its linear unit
+        line_spatial_reference = arcpy.da.Describe(new_stream_line)["spatialReference"]
+        transect_length = float(distance) * 2 * arcpy.LinearUnitConversionFactor(distance_unit, line_spatial_reference.linearUnitName)
+
         ## Debugging
         ## create temporary classes for debugging
         #lowpoints_fc = arcpy.management.CreateFeatureclass(env_path, "lowpoints", "POINT", spatial_reference=spatial_reference)
@@ -165,41 +174,52 @@ class LeastAction(object):
         #transects = []
         #lowpoints = []
 
-        # iterate through each stream line polyline
+        # dem cells under the current reach, None when the reach is sampled with
+        # extract_values instead
+        dem_window = None
+
+        def sample_elevations(xs, ys):
+            """Return the dem elevations at XS, YS for the current reach."""
+            if dem_window is None:
+                return extract_values(dem, xs, ys, line_spatial_reference)
+            return sample_window(dem_window, xs, ys)
+
+        # adjust each stream line polyline in place, every vertex of a reach is adjusted
+        # at once. only the coordinates are needed so they are parsed from json rather
+        # than walking full geometries, and the geometry is read once and overwritten
         log("optimizing stream line")
-        i = 1
-        n = len([row[0] for row in arcpy.da.SearchCursor(new_stream_line, ["SHAPE@"])])
-        with arcpy.da.UpdateCursor(new_stream_line, ["SHAPE@"]) as cursor:
-            for stream_line in cursor:
-                # set progress per reach
-                record_count = len(stream_line[0][0]) # number of vertices in a given reach, not the best way but it works on a per-reach basis
-                arcpy.SetProgressor("step", "iterating through vertices in stream reach to find lowest points", 0, record_count, 1)
-
-                # construct line for stream reach
-                new_stream_line_arr = arcpy.Array()
-
-                # iterate through each vertex of the given stream polyline
-                for vertex in stream_line[0][0]:
-                    #create transect at point
-                    transect = transect_line(stream_line[0], vertex, transect_length)
-                    #transects.append(transect)
-
-                    # find lowest point in transect
-                    new_point = self.lowestTransectPoint(transect, dem)
-                    new_stream_line_arr.add(new_point)
-                    #lowpoints.append(new_point)
-
-                    # update progress bar
-                    arcpy.SetProgressorPosition()
-
-                # add optimized reach to output
-                log("adding optimized reach {} of {} to output".format(i, n))
-                new_stream_line = arcpy.Polyline(new_stream_line_arr)
-                cursor.updateRow([new_stream_line])
-
-                # get progress bar ready for next reach
-                arcpy.SetProgressorPosition(record_count)
-                i+=1
+        n = int(arcpy.management.GetCount(new_stream_line)[0])
+        arcpy.SetProgressor("step", "finding lowest points along stream reaches", 0, n, 1)
+        with arcpy.da.UpdateCursor(new_stream_line, ["SHAPE@JSON"]) as cursor:
+            for i, (shape_json,) in enumerate(cursor, start=1):
+                paths = json_loads(shape_json).get("paths")
+                if paths:
+                    vertices = np.asarray(paths[0], dtype=np.float64)[:, :2]
+
+                    # transects at each vertex of the given stream polyline
+                    endpoints = vertex_transect_endpoints(vertices, transect_length)
+                    #transects.extend(arcpy.Polyline(arcpy.Array((arcpy.Point(*e[:2]), arcpy.Point(*e[2:]))), spatial_reference) for e in endpoints)
+
+                    # read the dem under the reach's transects into memory once so they are
+                    # sampled from an array, a window per reach keeps sparse networks from
+                    # reading the dem between reaches
+                    xs, ys = endpoints[:, [0, 2]], endpoints[:, [1, 3]]
+                    reach_extent = arcpy.Extent(xs.min(), ys.min(), xs.max(), ys.max())
+                    window_cells = (reach_extent.width / dem.meanCellWidth + 1) * (reach_extent.height / dem.meanCellHeight + 1)
+                    if window_cells > MAX_WINDOW_CELLS and arcpy.CheckExtension("Spatial") == "Available":
+                        # too large to hold in memory, sample every transect vertex with one tool call
+                        dem_window = None
+                    else:
+                        dem_window = raster_window(dem, reach_extent)
+
+                    # find lowest point in each transect
+                    new_vertices = self.lowestTransectPoints(endpoints, sample_elevations)
+                    #lowpoints.extend(arcpy.PointGeometry(arcpy.Point(*p), spatial_reference) for p in new_vertices)
+                    cursor.updateRow([json.dumps({"paths": [new_vertices.tolist()]})])
+
+                # update progress bar
+                log("optimized reach {} of {}".format(i, n))
+                arcpy.SetProgressorPosition()
         arcpy.ResetProgressor()
 
         ## Debugging
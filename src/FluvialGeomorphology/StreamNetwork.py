@@ -9,8 +9,8 @@
 
 import arcpy
 
-from ..helpers import license, get_oid, empty_workspace, convert_length, cell_area, reload_module,\
-    log, set_required_parameter, raster_and_layer, AREAL_UNITS, AREAL_UNITS_MAP
+from ..helpers import license, get_oid, empty_workspace, scratch_workspace, convert_length, cell_area, reload_module,\
+    log, set_required_parameter, raster_and_layer, flow_rasters, AREAL_UNITS, AREAL_UNITS_MAP
 from ..helpers import setup_environment as setup
 from ..helpers import validate_spatial_reference as validate
 
@@ -192,27 +192,23 @@ class StreamNetwork(object):
         if extent:
             arcpy.env.extent = extent
 
-        # create scratch layers
+        # create scratch layers, vector data in memory unless the input streams are very
+        # large and rasters in the scratch geodatabase
         log("creating scratch layers")
-        scratch_initiations = arcpy.CreateScratchName("initiations", data_type="FeatureClass", workspace=arcpy.env.scratchGDB)
-        scratch_end_points = arcpy.CreateScratchName("end_pts", data_type="FeatureClass", workspace=arcpy.env.scratchGDB)
-        scratch_feature = arcpy.CreateScratchName("feature", data_type="FeatureClass", workspace=arcpy.env.scratchGDB)
-        scratch_output = arcpy.CreateScratchName("output", data_type="FeatureClass", workspace=arcpy.env.scratchGDB)
-        scratch_stream = arcpy.CreateScratchName("stream", data_type="FeatureClass", workspace=arcpy.env.scratchGDB)
-        scratch_zonst = arcpy.CreateScratchName("zonst", data_type="RasterDataset", workspace=arcpy.env.scratchGDB)
-        scratch_max = arcpy.CreateScratchName("max", data_type="FeatureClass", workspace=arcpy.env.scratchGDB)
-
-        # fill DEM
-        log("filling raster")
-        fill_raster = arcpy.sa.Fill(dem)
-
-        # flow direction
-        log("calculating flow direction")
-        flow_direction = arcpy.sa.FlowDirection(fill_raster)
-
-        # flow accumulation
-        log("calculating flow accumulation")
-        flow_accumulation = arcpy.sa.FlowAccumulation(flow_direction)
+        ws = scratch_workspace(stream)
+        scratch_initiations = arcpy.CreateScratchName("initiations", data_type="FeatureClass", workspace=ws)
+        scratch_end_points = arcpy.CreateScratchName("end_pts", data_type="FeatureClass", workspace=ws)
+        scratch_feature = arcpy.CreateScratchName("feature", data_type="FeatureClass", workspace=ws)
+        scratch_output = arcpy.CreateScratchName("output", data_type="FeatureClass", workspace=ws)
+        scratch_stream = arcpy.CreateScratchName("stream", data_type="FeatureClass", workspace=ws)
+        scratch_zonst = arcpy.CreateScratchName("zonst", data_type="Dataset", workspace=ws)
+        scratch_max = arcpy.CreateScratchName("max", data_type="FeatureClass", workspace=ws)
+        scratch_flow_direction = arcpy.CreateScratchName("flow_dir", data_type="RasterDataset", workspace=arcpy.env.scratchGDB)
+        scratch_flow_accumulation = arcpy.CreateScratchName("flow_acc", data_type="RasterDataset", workspace=arcpy.env.scratchGDB)
+
+        # fill DEM, flow direction and flow accumulation
+        log("calculating flow direction and accumulation")
+        flow_direction, flow_accumulation = flow_rasters(dem, extent, scratch_flow_direction, scratch_flow_accumulation)
 
         if stream:
             if extent:
@@ -280,15 +276,14 @@ class StreamNetwork(object):
                 log("converting stream raster to output feature class")
                 arcpy.sa.StreamToFeature(out_path_accumulation_raster, flow_direction, scratch_feature, "SIMPLIFY")
         else:
-            # convert flow accumulation from number of cells to threshold area units
+            # convert the threshold from area units to a number of cells
             log("calculating watershed size")
             cell_size = float(cell_area(dem, threshold_unit).split(" ")[0])
-            watershed_size = flow_accumulation * cell_size
+            threshold_cells = float(threshold_size) / cell_size
 
-            # con
+            # con, a map algebra comparison rather than a where clause
             log("applying watershed size threshold")
-            sql_query = "VALUE > {}".format(threshold_size)
-            con_accumulation = arcpy.sa.Con(watershed_size, 1, "", sql_query)
+            con_accumulation = arcpy.sa.Con(flow_accumulation > threshold_cells, 1)
 
             # stream to feature
             log("creating stream feature")
@@ -375,6 +370,8 @@ class StreamNetwork(object):
 
         # cleanup
         log("deleting unneeded data")
-        empty_workspace(arcpy.env.scratchGDB, keep=[])
+        empty_workspace(ws, keep=[])
+        if ws != arcpy.env.scratchGDB:
+            empty_workspace(arcpy.env.scratchGDB, keep=[])
 
         return
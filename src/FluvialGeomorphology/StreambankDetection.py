@@ -8,10 +8,14 @@
 # --------------------------------------------------------------------------------
 import arcpy
 
-from ..helpers import license, empty_workspace, get_oid, reload_module, log, min_cell_path, raster_and_layer
+from ..helpers import license, empty_workspace, reload_module, log, min_cell_path, raster_and_layer
 from ..helpers import setup_environment as setup
 from ..helpers import validate_spatial_reference as validate
 
+# REM heights below this are flattened to the streambed before the hydraulic area is
+# accumulated, in the REM's z units
+STREAMBED_HEIGHT = 0.25
+
 class StreambankDetection:
     def __init__(self):
         """Define the tool (tool name is the name of the class)."""
@@ -83,8 +87,9 @@ class StreambankDetection:
         rem, _ = raster_and_layer(parameters[2].value)
         output_file = parameters[3].valueAsText
 
-        # set cell size
+        # set cell size, snapping to the rem keeps every raster below on its grid
         arcpy.env.cellSize = min_cell_path(parameters)
+        arcpy.env.snapRaster = rem
 
         # set analysis extent
         if extent:
@@ -104,26 +109,34 @@ class StreambankDetection:
         # smooth irregularities in streambed
         # TODO: low pass filter?
         log("smoothing streambed")
-        sql_query = "VALUE < 0.25" # TODO: find something more reasonable
-        con_rem = arcpy.sa.Con(rem, 0, rem, sql_query)
+        con_rem = arcpy.sa.Con(rem < STREAMBED_HEIGHT, 0, rem)
 
         # create distance cost raster "hydraulic area"
         # not actually hydraulic area since its the area under the curve not the area above the curve
+        # only the accumulated cost is used so DistanceAccumulation is enough, an
+        # allocation would also track and write the nearest stream of every cell
         log("calculating hydraulic area")
-        arcpy.sa.DistanceAllocation(
+        arcpy.sa.DistanceAccumulation(
             in_source_data=streams,
             in_cost_raster=con_rem,
-            out_distance_accumulation_raster=scratch_area,
-            source_field=get_oid(streams),
             distance_method="GEODESIC"
-        )
+        ).save(scratch_area)
 
-        # calculate output
+        # calculate output over the rasters where they overlap, on the rem's grid
         log("calculating relationship between height above thalweg and hydraulic depth")
-        ratio = (rem * distance)/(scratch_area - rem)
+        area = arcpy.Raster(scratch_area)
+        extents = [rem.extent, distance.extent, area.extent]
+        overlap = arcpy.Extent(
+            max(e.XMin for e in extents),
+            max(e.YMin for e in extents),
+            min(e.XMax for e in extents),
+            min(e.YMax for e in extents)
+        )
+        with arcpy.EnvManager(extent=overlap, snapRaster=rem):
+            ratio = (rem * distance)/(area - rem)
 
-        # con
-        bankful = arcpy.sa.Con(ratio, 1, None, "VALUE<=0")
+            # con
+            bankful = arcpy.sa.Con(ratio <= 0, 1)
 
         # raster to polygon
         arcpy.conversion.RasterToPolygon(
@@ -12,7 +12,6 @@ from .StreamNetwork import StreamNetwork
 from .StreambankDetection import StreambankDetection
 from .GenerateCrossSections import (
     GenerateCrossSections,
-    generate_transects,
     transect_line,
 )
 
@@ -22,6 +21,5 @@ __all__ = [
     "StreamNetwork",
     "StreambankDetection",
     "GenerateCrossSections",
-    "generate_transects",
     "transect_line",
 ]
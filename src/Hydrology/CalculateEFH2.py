@@ -8,12 +8,11 @@
 # --------------------------------------------------------------------------------
 import os
 import arcpy
-import pathlib
 import platform
 import openpyxl
 import datetime
 
-from ..helpers import license, get_oid, get_z_unit, get_linear_unit, empty_workspace, reload_module, log, raster_and_layer, Z_UNITS
+from ..helpers import license, get_z_unit, get_linear_unit, empty_workspace, scratch_workspace, reload_module, log, raster_and_layer, raster_maximum, raster_mean, fill_depressions, Z_UNITS
 from ..helpers import setup_environment as setup
 from ..helpers import validate_spatial_reference as validate
 
@@ -99,9 +98,10 @@ class CalculateEFH2:
         #  - if there is none, let the user define it
         #  - if it exists, set the value and hide the parameter
         #  - if it doesn't exist show the parameter and set the value to None
+        # use the parameters' text, .value would describe the whole dataset on every pass
         if not parameters[0].hasBeenValidated:
-            if parameters[0].value:
-                z_unit = get_z_unit(parameters[0].value)
+            if parameters[0].valueAsText:
+                z_unit = get_z_unit(parameters[0].valueAsText)
                 if z_unit:
                     parameters[1].enabled = False
                     parameters[1].value = z_unit
@@ -114,24 +114,21 @@ class CalculateEFH2:
 
         # get RCN fields
         if not parameters[3].hasBeenValidated:
-            if parameters[3].value:
+            if parameters[3].valueAsText:
                 parameters[4].enabled = True
                 parameters[5].enabled = True
                 parameters[6].enabled = True
                 parameters[7].enabled = True
-                fields = [f.name for f in arcpy.ListFields(parameters[3].value)]
+                fields = [f.name for f in arcpy.ListFields(parameters[3].valueAsText)]
                 parameters[4].filter.list = fields
                 parameters[5].filter.list = fields
                 parameters[6].filter.list = fields
                 parameters[7].filter.list = fields
-                if "hydgrpdcd" in fields:
-                    parameters[4].value = "hydgrpdcd"
-                if "RCN" in fields:
-                    parameters[5].value = "RCN"
-                if "Acres" in fields:
-                    parameters[6].value = "Acres"
-                if "LandUse" in fields:
-                    parameters[7].value = "LandUse"
+                # default to the fields Calculate Runoff Curve Numbers outputs
+                field_set = set(fields)
+                for i, field in {4: "hydgrpdcd", 5: "RCN", 6: "Acres", 7: "LandUse"}.items():
+                    if field in field_set:
+                        parameters[i].value = field
             else:
                 parameters[4].enabled = False
                 parameters[5].enabled = False
@@ -156,6 +153,9 @@ class CalculateEFH2:
         log("setting up project")
         project, active_map = setup()
 
+        # let PairwiseDissolve and the Spatial Analyst tools below run on every core
+        arcpy.env.parallelProcessingFactor = "100%"
+
         # read in parameters
         log("reading in parameters")
         dem, _ = raster_and_layer(parameters[0].value)
@@ -170,10 +170,12 @@ class CalculateEFH2:
         # utils
         watershed_layer_id = arcpy.ValidateTableName(rcn_layer.name)
 
-        # create scratch layers
+        # create scratch layers, in memory unless the input is very large
         log("creating scratch layers")
-        scratch_watershed = arcpy.CreateScratchName("scratch_watershed", data_type="DEFeatureClass", workspace=arcpy.env.scratchGDB)
-        scratch_table =arcpy.CreateUniqueName("zonalstatistics_{}".format(watershed_layer_id))
+        ws = scratch_workspace(rcn_layer)
+        scratch_watershed = arcpy.CreateScratchName("scratch_watershed", data_type="DEFeatureClass", workspace=ws)
+        # the filled dem is saved with DefineProjection, which needs a workspace on disk
+        scratch_fill = arcpy.CreateScratchName("scratch_fill", data_type="RasterDataset", workspace=arcpy.env.scratchGDB)
 
         # dissolve RCN boundaries to find watershed boundary
         log("dissolve RCN boundaries")
@@ -187,15 +189,14 @@ class CalculateEFH2:
         log("creating slope map")
         slope_raster = arcpy.sa.Slope(out_dem_watershed_clip, "PERCENT_RISE", "", "GEODESIC", z_unit)
 
-        # zonal statistics
+        # average slope, the slope raster is already masked to the watershed so the
+        # watershed is its only zone
         log("finding average slope")
-        field_name = get_oid(scratch_watershed)
-        arcpy.sa.ZonalStatisticsAsTable(scratch_watershed, field_name, slope_raster, scratch_table, "", "MEAN")
-        mean_slope = round(float([row[0] for row in arcpy.da.SearchCursor(scratch_table, "MEAN")][0]),2)
+        mean_slope = round(raster_mean(slope_raster),2)
 
         # fill DEM to eventually find flow length of watershed
         log("filling DEM for flow direction calculation")
-        filled_dem = arcpy.sa.Fill(out_dem_watershed_clip)
+        filled_dem = fill_depressions(out_dem_watershed_clip, None, scratch_fill)
 
         # calculate flow directions
         log("calculating flow direction")
@@ -208,48 +209,55 @@ class CalculateEFH2:
         # find maximum flow length
         log("finding max flow length")
         linear_unit = get_linear_unit(flow_length_raster)
-        flow_length_maximum = float(arcpy.management.GetRasterProperties(flow_length_raster, "MAXIMUM").getOutput(0))
+        # spatial analyst outputs usually carry statistics, only scan the cells without them
+        flow_length_maximum = flow_length_raster.maximum
+        if flow_length_maximum is None:
+            flow_length_maximum = raster_maximum(flow_length_raster)
         flow_length_maximum = int(flow_length_maximum * arcpy.LinearUnitConversionFactor(linear_unit, "FeetUS"))
 
-        # add acres field and calculate
-        log("calculating rcn acres")
-        if acres_field not in [f.name for f in arcpy.ListFields(rcn_layer)]:
+        # add acres field
+        if not arcpy.ListFields(rcn_layer, acres_field):
             arcpy.management.AddField(rcn_layer, acres_field, "FLOAT", field_precision=255, field_scale=2)
-        arcpy.management.CalculateGeometryAttributes(rcn_layer, geometry_property=[[acres_field, "AREA_GEODESIC"]], area_unit="ACRES_US")
-        sum_acres = round(sum([float(row[0]) for row in arcpy.da.SearchCursor(rcn_layer, acres_field)]),2)
 
         # setup hydrology worksheet locations
         log("creating hydrology worksheet")
         hydrology_worksheet = os.path.join(os.path.dirname(__file__), os.pardir, os.pardir, 'assets', 'Hydrology Data Form.xlsx')
-        output_worksheet_path = '{}\{}_hydrology.xlsx'.format(output_folder_path, watershed_layer_id)
-        output_worksheet_path = pathlib.PureWindowsPath(output_worksheet_path).as_posix()
+        output_worksheet_path = os.path.join(output_folder_path, "{}_hydrology.xlsx".format(watershed_layer_id))
+        project_name = os.path.splitext(os.path.basename(project.filePath))[0]
+        now = datetime.datetime.now()
 
         # fill out hydrology worksheet
         log("filling out hydrology worksheet")
-        hydrology_worksheet = openpyxl.load_workbook(hydrology_worksheet)
+        hydrology_worksheet = openpyxl.load_workbook(hydrology_worksheet, keep_links=False)
         ws_calculations = hydrology_worksheet['Calculations']
         ws_data = hydrology_worksheet['Data']
-        ws_calculations["E1"] = project.filePath.split("\\")[-1][:-5]
-        ws_calculations['F2'] = datetime.date.today().isoformat()
-        ws_calculations['G2'] = datetime.datetime.now().strftime("%H:%M:%S")
+
+        # calculate geodesic acres of each polygon, write rcn rows below the header by
+        # row and column index and total the acres in one cursor pass, the geometry is
+        # passed back unchanged
+        log("calculating rcn acres")
+        acres_factor = arcpy.ArealUnitConversionFactor("SquareMeters", "AcresUS")
+        sum_acres = 0
+        with arcpy.da.UpdateCursor(rcn_layer, ["OID@", "SHAPE@", land_use_field, hsg_field, rcn_field, acres_field]) as cursor:
+            cell = ws_data.cell
+            for idx, (oid, shape, land_use, hsg, rcn, _) in enumerate(cursor, start=2):
+                acres = shape.getArea("GEODESIC", "SQUAREMETERS") * acres_factor
+                cursor.updateRow([oid, shape, land_use, hsg, rcn, acres])
+                sum_acres += acres
+                cell(idx, 1, land_use)
+                cell(idx, 2, hsg)
+                cell(idx, 3, rcn)
+                cell(idx, 4, round(acres,2))
+        sum_acres = round(sum_acres, 2)
+
+        ws_calculations["E1"] = project_name
+        ws_calculations['F2'] = now.date().isoformat()
+        ws_calculations['G2'] = now.strftime("%H:%M:%S")
         ws_calculations['H2'] = watershed_layer_id
         ws_calculations['G4'] = sum_acres
         ws_calculations['G6'] = flow_length_maximum
         ws_calculations['G7'] = mean_slope
 
-        with arcpy.da.SearchCursor(rcn_layer, [rcn_field, acres_field, land_use_field, hsg_field]) as cursor:
-            idx = 2
-            for row in cursor:
-                rcn = row[0]
-                acres = row[1]
-                land_use = row[2]
-                hsg = row[3]
-                ws_data["C"+str(idx)] = rcn
-                ws_data["D"+str(idx)] = round(float(acres),2)
-                ws_data["A"+str(idx)] = land_use
-                ws_data["B"+str(idx)] = hsg
-                idx += 1
-
         hydrology_worksheet.save(output_worksheet_path)
         hydrology_worksheet.close()
         del hydrology_worksheet
@@ -257,8 +265,9 @@ class CalculateEFH2:
 
         # cleanup
         log("deleting unneeded data")
-        empty_workspace(arcpy.env.scratchGDB, keep=[])
-        arcpy.management.Delete([scratch_table])
+        empty_workspace(ws, keep=[])
+        if ws != arcpy.env.scratchGDB:
+            empty_workspace(arcpy.env.scratchGDB, keep=[])
 
         # save program successfully
         log("saving project")
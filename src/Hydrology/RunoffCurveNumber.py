@@ -227,25 +227,15 @@ class RunoffCurveNumber:
             output_type="INPUT"
         )
 
-        # calculate RCN from HSG
+        # calculate RCN from HSG, picking each row's RCN column by its HSG in one cursor pass
         log("calculate RCN from HSG")
-        arcpy.management.CalculateField(
-            in_table=output_fc,
-            field="RCN",
-            expression="calculate_value(!{}!, !{}!,!{}!,!{}!,!{}!)".format(hsg_field, rcn_field_a,rcn_field_b,rcn_field_c,rcn_field_d),
-            expression_type="PYTHON3",
-            code_block="""def calculate_value(hsg, rcna, rcnb, rcnc, rcnd):
-                if hsg == "A":
-                    return rcna
-                elif hsg == "B":
-                    return rcnb
-                elif hsg == "C":
-                    return rcnc
-                else:
-                    return rcnd""",
-            field_type="DOUBLE",
-            enforce_domains="NO_ENFORCE_DOMAINS"
-        )
+        if not arcpy.ListFields(output_fc, "RCN"):
+            arcpy.management.AddField(output_fc, "RCN", "DOUBLE")
+        hsg_columns = {"A": 1, "B": 2, "C": 3}
+        with arcpy.da.UpdateCursor(output_fc, [hsg_field, rcn_field_a, rcn_field_b, rcn_field_c, rcn_field_d, "RCN"]) as cursor:
+            for row in cursor:
+                row[5] = row[hsg_columns.get(row[0], 4)]
+                cursor.updateRow(row)
 
         # add runoff layer to map
         log("add runoff layer to map")
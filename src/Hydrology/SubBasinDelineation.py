@@ -101,8 +101,7 @@ class SubBasinDelineation(object):
 
         # con
         log("converting raster to stream network")
-        sql_query = "VALUE > {}".format(num_cells)
-        con_accumulation_scratch = arcpy.sa.Con(flow_accumulation_scratch, 1, "", sql_query)
+        con_accumulation_scratch = arcpy.sa.Con(flow_accumulation_scratch > num_cells, 1)
 
         # stream link
         log("calculating stream links")
@@ -116,6 +115,15 @@ class SubBasinDelineation(object):
         log("creating stream feature")
         stream_feature_path = "{}\\stream_to_feature".format(arcpy.env.workspace)
         stream_feature = arcpy.sa.StreamToFeature(con_accumulation_scratch, flow_direction_scratch, stream_feature_path, True)
+
+        # watershed raster to polyon
+        log("converting watershed to polygon")
+        watershed_polygon_path = "{}\\watershed_polygon".format(arcpy.env.workspace)
+        watershed_polygon = arcpy.conversion.RasterToPolygon(watershed, watershed_polygon_path, create_multipart_features=True)
+
+        # add outputs to the map once processing is done, so the map only redraws
+        # at the end rather than between geoprocessing steps
+        log("adding outputs to map")
         stream_feature = active_map.addDataFromPath(stream_feature)
         sym = stream_feature.symbology
         sym.renderer.symbol.color = {'RGB' : [0, 0, 0, 0]}
@@ -123,10 +131,6 @@ class SubBasinDelineation(object):
         sym.renderer.symbol.size = 1.5
         stream_feature.symbology = sym
 
-        # watershed raster to polyon
-        log("converting watershed to polygon")
-        watershed_polygon_path = "{}\\watershed_polygon".format(arcpy.env.workspace)
-        watershed_polygon = arcpy.conversion.RasterToPolygon(watershed, watershed_polygon_path, create_multipart_features=True)
         watershed_polygon = active_map.addDataFromPath(watershed_polygon)
         sym = watershed_polygon.symbology
         sym.updateRenderer('UniqueValueRenderer')
@@ -8,11 +8,91 @@
 # --------------------------------------------------------------------------------
 
 import arcpy
+import numpy as np
 
-from ..helpers import license, empty_workspace, reload_module, log, get_oid, raster_and_layer
+from ..helpers import license, empty_workspace, reload_module, log, get_oid, raster_and_layer, convert_length, map_blocks
 from ..helpers import setup_environment as setup
 from ..helpers import validate_spatial_reference as validate
 
+# scipy is optional, its k-d tree interpolates the REM when it is installed and
+# Spatial Analyst's Idw is used otherwise
+try:
+    from scipy.spatial import cKDTree
+except ImportError:
+    cKDTree = None
+
+# numba is optional, idw_window weights each block of cells with a compiled kernel when
+# it is installed and with numpy otherwise
+try:
+    from numba import njit, prange
+except ImportError:
+    njit = None
+
+# number of cells interpolated per k-nearest neighbour query, bounds the memory used
+# by the (cells, num_points) distance and index arrays
+IDW_BLOCK_CELLS = 1000000
+
+if njit is not None:
+    @njit(parallel=True, cache=True)
+    def _idw_block(distance, index, values, power, out):
+        """Write the inverse distance weighted value of each row of DISTANCE and INDEX, as
+        returned by cKDTree.query, to OUT. Missing neighbours have an index of len(values)."""
+        for i in prange(distance.shape[0]):
+            numerator = 0.0
+            denominator = 0.0
+            for j in range(distance.shape[1]):
+                # neighbours are sorted by distance, so the rest are missing too
+                if index[i, j] == len(values):
+                    break
+                # a cell on a point takes its value
+                if distance[i, j] == 0:
+                    numerator = values[index[i, j]]
+                    denominator = 1.0
+                    break
+                weight = 1.0 / distance[i, j] ** power
+                numerator += weight * values[index[i, j]]
+                denominator += weight
+            out[i] = numerator / denominator if denominator > 0 else np.nan
+
+def idw_window(tree, values, window, num_points: int, max_distance: float, power: float=2) -> np.ndarray:
+    """Inverse distance weighted interpolation of VALUES at the points of cKDTree TREE onto
+    the cells of a raster_window WINDOW, matching arcpy.sa.Idw with a variable search radius.
+    Each cell uses its NUM_POINTS nearest points within MAX_DISTANCE. Only cells with data in
+    the window are interpolated, cells without data or without nearby points are NaN."""
+    array, origin, (cell_width, cell_height) = window
+    if not len(values):
+        return np.full(array.shape, np.nan)
+
+    k = min(num_points, len(values))
+    padded_values = np.append(values, np.nan)
+
+    # cell centers of every cell with data
+    rows, cols = np.nonzero(~np.isnan(array))
+    xy = np.column_stack((origin[0] + (cols + 0.5) * cell_width, origin[1] - (rows + 0.5) * cell_height))
+
+    interpolated = np.full(array.shape, np.nan)
+    for start in range(0, len(xy), IDW_BLOCK_CELLS):
+        stop = start + IDW_BLOCK_CELLS
+        distance, index = tree.query(xy[start:stop], k=k, distance_upper_bound=max_distance, workers=-1)
+        distance = distance.reshape(len(distance), k)
+        index = index.reshape(len(index), k)
+
+        if njit is not None:
+            block = np.empty(len(distance))
+            _idw_block(distance, index, values, float(power), block)
+        else:
+            # neighbours past max_distance have infinite distance and get no weight
+            with np.errstate(divide="ignore", invalid="ignore"):
+                weight = 1.0 / distance ** power
+                block = np.nansum(weight * padded_values[index], axis=1) / weight.sum(axis=1)
+
+            # a cell on a point takes its value
+            exact = distance[:, 0] == 0
+            block[exact] = values[index[exact, 0]]
+        interpolated[rows[start:stop], cols[start:stop]] = block
+
+    return interpolated
+
 def relative_elevation_model(active_map, dem_raster, extent, stream_layer, buffer_radius, sampling_interval, resolve):
     # set analysis extent
     if extent:
@@ -39,68 +119,85 @@ def relative_elevation_model(active_map, dem_raster, extent, stream_layer, buffe
     log("creating buffer polygon around stream")
     arcpy.analysis.PairwiseBuffer(scratch_stream_layer, scratch_stream_buffer, buffer_radius, "ALL", "", "GEODESIC", "")
 
-    # clip dem to buffer
-    log("clipping DEM to buffer")
-    dem_raster_clip = arcpy.sa.ExtractByMask(dem_raster, scratch_stream_buffer, "INSIDE", "MINOF")
-
     # generate points along line
     log("generating points along stream")
     arcpy.management.GeneratePointsAlongLines(scratch_stream_layer, scratch_stream_points, "DISTANCE", sampling_interval, "", "END_POINTS", "NO_CHAINAGE")
 
     # extract values to points
     log("adding elevation data to stream line points")
-    arcpy.sa.ExtractValuesToPoints(scratch_stream_points, dem_raster_clip, scratch_stream_elev_points, "NONE", "VALUE_ONLY")
+    arcpy.sa.ExtractValuesToPoints(scratch_stream_points, dem_raster, scratch_stream_elev_points, "NONE", "VALUE_ONLY")
 
-    idw_raster = None
-    arcpy.env.cellSize = dem_raster_clip
+    arcpy.env.cellSize = dem_raster
     arcpy.env.extent = scratch_stream_buffer
     buffer_radius, buffer_radius_unit = buffer_radius.split(" ")
     max_distance = 1.5 * int(buffer_radius) * arcpy.LinearUnitConversionFactor(buffer_radius_unit, active_map.mapUnits)
     num_points = 12
     search_radius = arcpy.sa.RadiusVariable(num_points, max_distance)
-    if resolve:
-        # interpolate surface and resolve buffer overlap conflicts by watershed
-        log("calculating sub-watersheds to resolve interpolation conflicts")
-        fill_raster = arcpy.sa.Fill(dem_raster)
-        flow_direction = arcpy.sa.FlowDirection(fill_raster, flow_direction_type="D8")
-        watershed = arcpy.sa.Watershed(
-            in_flow_direction_raster=flow_direction,
-            in_pour_point_data=scratch_stream_layer,
-            pour_point_field=get_oid(scratch_stream_layer)
-        )
-
-        # create watershed breaklines to separate IDW calculation for each watershed
-        arcpy.conversion.RasterToPolygon(
-            in_raster=watershed,
-            simplify=True,
-            out_polygon_features=scratch_watershed,
-            raster_field="Value",
-            create_multipart_features=True,
-        )
-        arcpy.management.PolygonToLine(scratch_watershed, scratch_breaklines)
+    if resolve or cKDTree is None or dem_raster.spatialReference.type == "Geographic":
+        # interpolate surface with Idw, which resolves buffer overlap conflicts by
+        # watershed when resolving and by proximity otherwise. Idw is also used for
+        # proximity when scipy isn't installed and for geographic dems, whose cell
+        # distances are angular rather than linear
+        if resolve:
+            log("calculating sub-watersheds to resolve interpolation conflicts")
+            fill_raster = arcpy.sa.Fill(dem_raster)
+            flow_direction = arcpy.sa.FlowDirection(fill_raster, flow_direction_type="D8")
+            watershed = arcpy.sa.Watershed(
+                in_flow_direction_raster=flow_direction,
+                in_pour_point_data=scratch_stream_layer,
+                pour_point_field=get_oid(scratch_stream_layer)
+            )
+
+            # create watershed breaklines to separate IDW calculation for each watershed
+            arcpy.conversion.RasterToPolygon(
+                in_raster=watershed,
+                simplify=True,
+                out_polygon_features=scratch_watershed,
+                raster_field="Value",
+                create_multipart_features=True,
+            )
+            arcpy.management.PolygonToLine(scratch_watershed, scratch_breaklines)
 
         # This has the known side-effect of producing missing artefacts in the output
         # REM raster where the sightlines are blocked for IDW in_barrier_polyline_features.
         # However, it is 2-3x slower to IDW each watershed and append them together.
-        log("calculating IDW raster")
-        idw_raster = arcpy.sa.Idw(
-            in_point_features=scratch_stream_elev_points,
-            z_field="RASTERVALU",
-            search_radius=search_radius,
-            in_barrier_polyline_features=scratch_breaklines,
-        )
+        # the buffer is applied as the analysis mask rather than clipping the dem first,
+        # so only cells in the buffer are interpolated and the dem is read once
+        with arcpy.EnvManager(mask=scratch_stream_buffer, snapRaster=dem_raster):
+            log("calculating IDW raster")
+            idw_raster = arcpy.sa.Idw(
+                in_point_features=scratch_stream_elev_points,
+                z_field="RASTERVALU",
+                search_radius=search_radius,
+                in_barrier_polyline_features=scratch_breaklines if resolve else None,
+            )
+
+            # raster calculator (DEM - IDW_new)
+            log("calculating relative elevation difference")
+            rem = dem_raster - idw_raster
     else:
-        # interpolate surface and resolve buffer overlap conflicts by proximity
-        log("calculating IDW raster")
-        idw_raster = arcpy.sa.Idw(
-            in_point_features=scratch_stream_elev_points,
-            z_field="RASTERVALU",
-            search_radius=search_radius,
-        )
-
-    # raster calculator (DEM - IDW_new)
-    log("calculating relative elevation difference")
-    rem = dem_raster_clip - idw_raster
+        # interpolate surface and resolve buffer overlap conflicts by proximity, the
+        # same interpolation as Idw with a variable radius but from a k-d tree of the
+        # stream points, so each cell only weighs its nearest points
+        log("clipping DEM to buffer")
+        dem_raster_clip = arcpy.sa.ExtractByMask(dem_raster, scratch_stream_buffer, "INSIDE", "MINOF")
+
+        spatial_reference = dem_raster_clip.spatialReference
+        points = arcpy.da.FeatureClassToNumPyArray(scratch_stream_elev_points, ["SHAPE@X", "SHAPE@Y", "RASTERVALU"], skip_nulls=True, spatial_reference=spatial_reference)
+        points = points[points["RASTERVALU"] != -9999]
+        elevations = points["RASTERVALU"].astype(np.float64)
+        tree = cKDTree(np.column_stack((points["SHAPE@X"], points["SHAPE@Y"])))
+        max_distance = 1.5 * float(convert_length(" ".join((buffer_radius, buffer_radius_unit)), spatial_reference.linearUnitName).split(" ")[0])
+
+        def block_rem(dem, origin, cell_size):
+            """Return DEM minus the interpolated stream elevations of a block of cells."""
+            idw = idw_window(tree, elevations, (dem, origin, cell_size), num_points, max_distance)
+            return np.subtract(dem, idw, out=idw).astype(np.float32)
+
+        # raster calculator (DEM - IDW_new), a block of rows of the dem at a time
+        log("calculating IDW raster and relative elevation difference")
+        scratch_rem = arcpy.CreateScratchName("rem", data_type="RasterDataset", workspace=arcpy.env.scratchGDB)
+        rem = map_blocks(block_rem, [dem_raster_clip], dem_raster_clip.extent, scratch_rem, np.nan, with_window=True)
 
     return rem
 
@@ -10,7 +10,7 @@
 import arcpy
 
 from ..FluvialGeomorphology import transect_line
-from ..helpers import license, pixel_type, get_linear_unit, empty_workspace, reload_module, log, error, raster_and_layer
+from ..helpers import license, pixel_type, get_linear_unit, convert_length, empty_workspace, reload_module, log, error, raster_and_layer
 from ..helpers import setup_environment as setup
 from ..helpers import validate_spatial_reference as validate
 
@@ -297,12 +297,13 @@ class DamRemoval(object):
         # impove point density with transects using the new mosaic
         log("creating transects and interpolating elevations")
         new_points = []
+        transect_length = float(convert_length(transect_width, centerline_polyline.spatialReference.linearUnitName).split(" ")[0])
         with arcpy.da.SearchCursor(scratch_centerline_elev_points, ["SHAPE@", "RASTERVALU", "ORIG_LEN"]) as cursor:
             for point in cursor:
                 # read in values
                 shape, elev, distance = point[0], point[1], point[2]
                 # create transect
-                transect = transect_line(centerline_polyline, shape, transect_width)
+                transect = transect_line(centerline_polyline, shape, transect_length)
                 # interpolate elevations
                 tmp_points = self.interpolateElevations(transect, scratch_mosaic_raster, elev, transect_width, transect_point_spacing, scratch_transect_points, scratch_transect_elev_points)
                 # add points to list of new points
@@ -63,8 +63,9 @@ class ExportLayouts(object):
         # Export layouts
         for layout in project_layouts:
             if layout.name in layouts:
-                layout_file_path = "{}\{}.pdf".format(file_path, layout.name)
+                layout_file_path = "{}\\{}.pdf".format(file_path, layout.name)
                 layout.exportToPDF(layout_file_path)
+                log("exported {}".format(layout_file_path))
 
         if platform.system() == "Windows":
             # Open project folder
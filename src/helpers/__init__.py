@@ -21,8 +21,18 @@ from .rasters import (
     min_cell_path,
     cells_per_area,
     cells_per_length,
+    raster_window,
+    sample_window,
+    align_windows,
+    raster_maximum,
+    raster_mean,
+    save_window,
+    map_blocks,
+    extract_values,
+    fill_depressions,
+    flow_rasters,
 )
-from .tool import license, setup_environment, reload_module, empty_workspace
+from .tool import license, setup_environment, reload_module, empty_workspace, scratch_workspace
 from .units import (
     get_z_unit,
     get_linear_unit,
@@ -54,10 +64,21 @@ __all__ = [
     "min_cell_path",
     "cells_per_area",
     "cells_per_length",
+    "raster_window",
+    "sample_window",
+    "align_windows",
+    "raster_maximum",
+    "raster_mean",
+    "save_window",
+    "map_blocks",
+    "extract_values",
+    "fill_depressions",
+    "flow_rasters",
     "license",
     "setup_environment",
     "reload_module",
     "empty_workspace",
+    "scratch_workspace",
     "get_z_unit",
     "get_linear_unit",
     "Z_UNITS",
@@ -10,24 +10,18 @@ import arcpy
 
 def log(*args):
     """Print out messages."""
-    out_str = ""
-    for arg in args:
-        out_str += str(arg)+" "
+    out_str = "".join(str(arg)+" " for arg in args)
     arcpy.AddMessage(out_str+"\n") # and newline and print
     return
 
 def warn(*args):
     """Print out warnings."""
-    out_str = ""
-    for arg in args:
-        out_str += str(arg)+" "
+    out_str = "".join(str(arg)+" " for arg in args)
     arcpy.AddWarning(out_str+"\n") # and newline and print
     return
 
 def error(*args):
     """Print out errors."""
-    out_str = ""
-    for arg in args:
-        out_str += str(arg)+" "
+    out_str = "".join(str(arg)+" " for arg in args)
     arcpy.AddError(out_str+"\n") # and newline and print
     return
@@ -6,10 +6,29 @@
 #              Full license in LICENSE file.
 # -----------------------------------------------------------------------------------
 
+import os
+import math
 import arcpy
+import numpy as np
 
 from .units import convert_area, convert_length, LINEAR_TO_AREAL, SPATIAL_TO_LINEAR
 
+# pysheds is optional, its numba compiled flow routing is used by flow_rasters when
+# it is installed and Spatial Analyst is used otherwise
+try:
+    from affine import Affine
+    from pysheds.grid import Grid
+    from pysheds.sview import Raster as GridRaster, ViewFinder
+except ImportError:
+    Grid = None
+
+# richdem is optional, its priority flood is used by fill_depressions when it is
+# installed and Spatial Analyst's Fill is used otherwise
+try:
+    import richdem
+except ImportError:
+    richdem = None
+
 PIXEL_TYPES = {
     "U1": "1_BIT",
     "U2": "2_BIT",
@@ -24,6 +43,18 @@ PIXEL_TYPES = {
     "F64": "64_BIT"
 }
 
+# pixel types of rasters saved from numpy arrays, by array dtype
+NUMPY_PIXEL_TYPES = {
+    "uint8": "8_BIT_UNSIGNED",
+    "int8": "8_BIT_SIGNED",
+    "uint16": "16_BIT_UNSIGNED",
+    "int16": "16_BIT_SIGNED",
+    "uint32": "32_BIT_UNSIGNED",
+    "int32": "32_BIT_SIGNED",
+    "float32": "32_BIT_FLOAT",
+    "float64": "64_BIT"
+}
+
 def pixel_type(raster) -> str:
     """Return the the string representation of the raster pixel type."""
     return PIXEL_TYPES[raster.pixelType]
@@ -112,3 +143,230 @@ def min_cell_path(parameters) -> str:
             pass
 
     return min_cell_path
+
+
+def raster_window(raster, extent, buffer: float=0) -> tuple[np.ndarray, tuple[float, float], tuple[float, float]]:
+    """Read the cells of RASTER covering EXTENT, grown by BUFFER raster units, into memory.
+    Returns the cell values as a float array with NoData as NaN, the (x, y) of the array's
+    upper left corner and the (width, height) of a cell. The window is snapped outward to
+    the raster's cells and clipped to the raster's extent."""
+    cell_width = raster.meanCellWidth
+    cell_height = raster.meanCellHeight
+    raster_extent = raster.extent
+
+    # window bounds in cells from the raster's upper left corner
+    col_min = max(0, math.floor((extent.XMin - buffer - raster_extent.XMin) / cell_width))
+    col_max = min(raster.width, math.ceil((extent.XMax + buffer - raster_extent.XMin) / cell_width))
+    row_min = max(0, math.floor((raster_extent.YMax - extent.YMax - buffer) / cell_height))
+    row_max = min(raster.height, math.ceil((raster_extent.YMax - extent.YMin + buffer) / cell_height))
+
+    origin = (raster_extent.XMin + col_min * cell_width, raster_extent.YMax - row_min * cell_height)
+    cell_size = (cell_width, cell_height)
+
+    # extent doesn't overlap the raster, note ncols / nrows of 0 would read everything
+    if col_max <= col_min or row_max <= row_min:
+        return np.empty((0, 0)), origin, cell_size
+
+    lower_left = arcpy.Point(origin[0], raster_extent.YMax - row_max * cell_height)
+    array = arcpy.RasterToNumPyArray(raster, lower_left, col_max - col_min, row_max - row_min).astype(np.float64)
+    if raster.noDataValue is not None:
+        array[array == raster.noDataValue] = np.nan
+
+    return array, origin, cell_size
+
+def sample_window(window, xs, ys) -> np.ndarray:
+    """Return the cell values of a raster_window WINDOW at coordinates XS, YS.
+    Coordinates outside of the window are NaN."""
+    array, origin, cell_size = window
+    cols = np.floor((np.asarray(xs) - origin[0]) / cell_size[0]).astype(np.int64)
+    rows = np.floor((origin[1] - np.asarray(ys)) / cell_size[1]).astype(np.int64)
+    inside = (rows >= 0) & (rows < array.shape[0]) & (cols >= 0) & (cols < array.shape[1])
+
+    values = np.full(cols.shape, np.nan)
+    values[inside] = array[rows[inside], cols[inside]]
+    return values
+
+def align_windows(windows) -> tuple[list[np.ndarray], tuple[float, float], tuple[float, float]]:
+    """Trim raster_window WINDOWS of rasters on the same cell grid to the cells every
+    window covers. Returns the trimmed arrays, the (x, y) of their upper left corner and
+    the (width, height) of a cell. Raises a ValueError if the cell sizes of the windows
+    differ or their origins are not a whole number of cells apart."""
+    cell_width, cell_height = windows[0][2]
+    left = max(origin[0] for _, origin, _ in windows)
+    top = min(origin[1] for _, origin, _ in windows)
+    right = min(origin[0] + array.shape[1] * cell_width for array, origin, _ in windows)
+    bottom = max(origin[1] - array.shape[0] * cell_height for array, origin, _ in windows)
+    cols = max(0, round((right - left) / cell_width))
+    rows = max(0, round((top - bottom) / cell_height))
+
+    arrays = []
+    for array, origin, cell_size in windows:
+        if not np.allclose(cell_size, (cell_width, cell_height)):
+            raise ValueError("Rasters have different cell sizes {} and {}.".format(cell_size, (cell_width, cell_height)))
+
+        # offset of the shared corner within this window, in cells
+        col = (left - origin[0]) / cell_width
+        row = (origin[1] - top) / cell_height
+        if abs(col - round(col)) > 1e-6 or abs(row - round(row)) > 1e-6:
+            raise ValueError("Rasters are not aligned to the same cell grid.")
+        col, row = round(col), round(row)
+        arrays.append(array[row:row + rows, col:col + cols])
+
+    return arrays, (left, top), (cell_width, cell_height)
+
+def raster_maximum(raster, block_rows: int=4096) -> float:
+    """Return the largest cell value of RASTER, ignoring NoData, reading it BLOCK_ROWS
+    rows at a time so large rasters are never held in memory at once. NaN if every
+    cell is NoData."""
+    extent = raster.extent
+    maximum = np.nan
+    for row in range(0, raster.height, block_rows):
+        y_max = extent.YMax - row * raster.meanCellHeight
+        y_min = max(extent.YMin, y_max - block_rows * raster.meanCellHeight)
+        block = raster_window(raster, arcpy.Extent(extent.XMin, y_min, extent.XMax, y_max))[0]
+        if block.size:
+            maximum = np.fmax(maximum, np.fmax.reduce(block, axis=None))
+    return float(maximum)
+
+def raster_mean(raster, block_rows: int=4096) -> float:
+    """Return the mean cell value of RASTER, ignoring NoData, reading it BLOCK_ROWS
+    rows at a time like raster_maximum. NaN if every cell is NoData."""
+    extent = raster.extent
+    total = 0.0
+    count = 0
+    for row in range(0, raster.height, block_rows):
+        y_max = extent.YMax - row * raster.meanCellHeight
+        y_min = max(extent.YMin, y_max - block_rows * raster.meanCellHeight)
+        block = raster_window(raster, arcpy.Extent(extent.XMin, y_min, extent.XMax, y_max))[0]
+        valid = ~np.isnan(block)
+        total += float(block.sum(where=valid))
+        count += int(valid.sum())
+    return total / count if count else math.nan
+
+def save_window(window, out_raster: str, spatial_reference, nodata=None) -> arcpy.Raster:
+    """Save a raster_window style WINDOW of (array, origin, cell size) to OUT_RASTER in
+    SPATIAL_REFERENCE, with NODATA cells written as NoData. Returns the saved raster."""
+    array, origin, (cell_width, cell_height) = window
+    lower_left = arcpy.Point(origin[0], origin[1] - array.shape[0] * cell_height)
+    arcpy.NumPyArrayToRaster(array, lower_left, cell_width, cell_height, nodata).save(out_raster)
+    arcpy.management.DefineProjection(out_raster, spatial_reference)
+    return arcpy.Raster(out_raster)
+
+def map_blocks(function, rasters: list, extent, out_raster: str, nodata=None, block_rows: int=512, with_window: bool=False) -> arcpy.Raster:
+    """Save FUNCTION applied to the cells of RASTERS within EXTENT to OUT_RASTER, with NODATA
+    cells written as NoData. Only BLOCK_ROWS rows of each raster are read at a time and each
+    block is saved on its own before the blocks are mosaicked, so no raster is held in
+    memory whole. FUNCTION is called with one array per raster, aligned by align_windows,
+    followed by the block's upper left corner and cell size when WITH_WINDOW is true, and
+    returns the output cells. Returns the saved raster."""
+    cell_height = rasters[0].meanCellHeight
+    spatial_reference = rasters[0].spatialReference
+    workspace = os.path.dirname(out_raster)
+
+    blocks = []
+    y_max = extent.YMax
+    while y_max > extent.YMin:
+        y_min = max(extent.YMin, y_max - block_rows * cell_height)
+        block_extent = arcpy.Extent(extent.XMin, y_min, extent.XMax, y_max)
+        arrays, origin, cell_size = align_windows([raster_window(raster, block_extent) for raster in rasters])
+        y_max = y_min
+        if not arrays[0].size:
+            continue
+
+        values = function(*arrays, origin, cell_size) if with_window else function(*arrays)
+        block = arcpy.CreateScratchName("block", data_type="RasterDataset", workspace=workspace)
+        save_window((values, origin, cell_size), block, spatial_reference, nodata)
+        blocks.append(block)
+
+    if not blocks:
+        raise ValueError("Extent does not overlap the rasters.")
+
+    arcpy.management.MosaicToNewRaster(
+        input_rasters=blocks,
+        output_location=workspace,
+        raster_dataset_name_with_extension=os.path.basename(out_raster),
+        coordinate_system_for_the_raster=spatial_reference,
+        pixel_type=NUMPY_PIXEL_TYPES[values.dtype.name],
+        cellsize=cell_size[0],
+        number_of_bands=1
+    )
+    arcpy.management.Delete(blocks)
+    return arcpy.Raster(out_raster)
+
+def extract_values(raster, xs, ys, spatial_reference) -> np.ndarray:
+    """Return the cell values of RASTER at coordinates XS, YS in SPATIAL_REFERENCE with a
+    single ExtractValuesToPoints call, for areas too large to read with raster_window.
+    NoData and coordinates off the raster are NaN. Requires Spatial Analyst."""
+    xs = np.asarray(xs, dtype=np.float64)
+    ys = np.asarray(ys, dtype=np.float64)
+
+    # write every coordinate to one in memory point feature class
+    points = arcpy.CreateScratchName("sample_points", data_type="FeatureClass", workspace="memory")
+    sampled = arcpy.CreateScratchName("sampled_points", data_type="FeatureClass", workspace="memory")
+    arcpy.management.CreateFeatureclass(os.path.dirname(points), os.path.basename(points), "POINT", spatial_reference=spatial_reference)
+    arcpy.management.AddField(points, "sample_id", "LONG")
+    with arcpy.da.InsertCursor(points, ["SHAPE@XY", "sample_id"]) as cursor:
+        for i, xy in enumerate(zip(xs.ravel().tolist(), ys.ravel().tolist())):
+            cursor.insertRow([xy, i])
+
+    # sample the raster at every point at once
+    arcpy.sa.ExtractValuesToPoints(points, raster, sampled, "NONE", "VALUE_ONLY")
+    values = np.full(xs.size, np.nan)
+    with arcpy.da.SearchCursor(sampled, ["sample_id", "RASTERVALU"]) as cursor:
+        for i, value in cursor:
+            # NoData cells are written as -9999
+            if value is not None and value != -9999:
+                values[i] = value
+
+    arcpy.management.Delete([points, sampled])
+    return values.reshape(xs.shape)
+
+def fill_depressions(dem, extent, out_raster: str) -> arcpy.Raster:
+    """Return DEM within EXTENT with its depressions filled. Uses richdem's priority
+    flood when it is installed, saving to OUT_RASTER, and Spatial Analyst's Fill
+    otherwise."""
+    if richdem is None:
+        return arcpy.sa.Fill(dem)
+
+    # richdem needs a finite NoData value
+    array, origin, cell_size = raster_window(dem, extent or dem.extent)
+    nodata = np.nanmin(array) - 1 if np.isfinite(array).any() else -9999.0
+    no_dem = np.isnan(array)
+    array[no_dem] = nodata
+
+    filled = np.asarray(richdem.FillDepressions(richdem.rdarray(array, no_data=nodata), epsilon=False, in_place=False))
+    filled[no_dem] = np.nan
+    return save_window((filled.astype(np.float32), origin, cell_size), out_raster, dem.spatialReference, np.nan)
+
+def flow_rasters(dem, extent, out_direction: str, out_accumulation: str) -> tuple[arcpy.Raster, arcpy.Raster]:
+    """Return D8 flow direction and flow accumulation rasters of the filled DEM within
+    EXTENT, encoded as Spatial Analyst's FlowDirection and FlowAccumulation. Uses pysheds
+    when it is installed, saving to OUT_DIRECTION and OUT_ACCUMULATION, and Spatial
+    Analyst otherwise."""
+    if Grid is None:
+        out_fill = arcpy.CreateScratchName("fill", data_type="RasterDataset", workspace=os.path.dirname(out_direction))
+        flow_direction = arcpy.sa.FlowDirection(fill_depressions(dem, extent, out_fill))
+        return flow_direction, arcpy.sa.FlowAccumulation(flow_direction)
+
+    # read the dem into a pysheds grid, NoData needs a finite value
+    array, origin, (cell_width, cell_height) = raster_window(dem, extent or dem.extent)
+    nodata = np.nanmin(array) - 1 if np.isfinite(array).any() else -9999.0
+    no_dem = np.isnan(array)
+    array[no_dem] = nodata
+    view = ViewFinder(affine=Affine(cell_width, 0, origin[0], 0, -cell_height, origin[1]), shape=array.shape, nodata=nodata)
+    grid = Grid(viewfinder=view)
+
+    # fill, then route flats so every cell drains, pysheds' default direction map is
+    # the same 1 - 128 encoding as FlowDirection
+    filled = grid.resolve_flats(grid.fill_depressions(grid.fill_pits(GridRaster(array, viewfinder=view))))
+    grid_direction = grid.flowdir(filled)
+    direction = np.asarray(grid_direction).astype(np.int32)
+    direction[no_dem | (direction <= 0)] = 0
+
+    # pysheds counts each cell in its own accumulation, FlowAccumulation does not
+    accumulation = np.asarray(grid.accumulation(grid_direction)).astype(np.float32) - 1
+    accumulation[no_dem] = np.nan
+
+    window = (origin, (cell_width, cell_height))
+    return (save_window((direction, *window), out_direction, dem.spatialReference, 0),
+            save_window((accumulation, *window), out_accumulation, dem.spatialReference, np.nan))
@@ -9,11 +9,16 @@
 
 import os
 import sys
-from functools import wraps
+from functools import lru_cache, wraps
 from importlib import import_module
 from packaging.version import Version
 import arcpy
 
+@lru_cache(maxsize=1)
+def __installed_version() -> Version:
+    """Return the installed ArcGIS version, which can't change within a session."""
+    return Version(arcpy.GetInstallInfo()['Version'])
+
 # only needed for spatial analyst, but potential image analyst, ddd or others if
 # we end up using them
 # https://pro.arcgis.com/en/pro-app/3.3/arcpy/functions/checkextension.htm
@@ -21,8 +26,7 @@ def license(licenses=[], version_required=""):
     """Verify the required licenses are installed."""
     try:
         if version_required:
-            v_installed = arcpy.GetInstallInfo()['Version']
-            if Version(v_installed) < Version(version_required):
+            if __installed_version() < Version(version_required):
                 return False
         for l in licenses:
             if l == "OSWCD_GIS":
@@ -37,6 +41,11 @@ def license(licenses=[], version_required=""):
         return False
 
 
+@lru_cache(maxsize=1)
+def __spatial_reference(name: str) -> arcpy.SpatialReference:
+    """Return a SpatialReference for NAME, reused across repeated tool runs."""
+    return arcpy.SpatialReference(name)
+
 def setup_environment():
     """Setup project environment for analysis and return project and active map."""
     # setup project and active map
@@ -44,11 +53,13 @@ def setup_environment():
     active_map = project.activeMap
 
     # setup arcpy environmental variables
+    # note: the environment is reset by ArcGIS between tool runs so these are
+    # applied on every call, only the spatial reference construction is cached
     arcpy.env.overwriteOutput = True
     arcpy.env.scratchWorkspace = arcpy.env.scratchGDB
     if arcpy.env.outputCoordinateSystem is None:
         spatial_reference_name = active_map.spatialReference.name
-        arcpy.env.outputCoordinateSystem = arcpy.SpatialReference(spatial_reference_name)
+        arcpy.env.outputCoordinateSystem = __spatial_reference(spatial_reference_name)
 
     return project, active_map
 
@@ -85,6 +96,14 @@ def reload_module(name, force=True):
         return wrapper
     return reload_module
 
+def scratch_workspace(features=None, max_features: int=100000) -> str:
+    """Return the in memory workspace for scratch data, falling back to the scratch
+    geodatabase when FEATURES has more than MAX_FEATURES features."""
+    if features is not None and int(arcpy.management.GetCount(features)[0]) > max_features:
+        return arcpy.env.scratchGDB
+
+    return "memory"
+
 def __empty_workspace(ws_path: str, keep: list[str]=[]) -> None:
     """License:  Modification of work in NRCS Engineering Tools 2.0 (no license present)
                  Assumed to fall under this project's license: GNU Affero General Public
@@ -104,7 +123,10 @@ def __empty_workspace(ws_path: str, keep: list[str]=[]) -> None:
 
 def empty_workspace(ws_path: str, keep: list[str]=[]) -> None:
     """Delete everything in a given workspace except for KEEP paths."""
-    if len(keep) > 0:
+    if ws_path == "memory" and len(keep) == 0:
+        # the in memory workspace is cleared in one go
+        arcpy.management.Delete("memory")
+    elif len(keep) > 0:
         __empty_workspace(ws_path, keep)
     else:
         # get workspace type